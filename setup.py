@@ -12,11 +12,14 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
         'google-api-python-client>=1.7.3',
-        'beautifulsoup4>=4.0.0',
         'python-dateutil>=2.8.1',
         'oauth2client>=4.1.3',
         'lxml>=4.4.2'
     ],
+    extras_require={
+        'orjson': ['orjson>=3.0.0'],
+        'pybase64': ['pybase64>=1.0.0'],
+    },
     setup_requires=["pytest-runner"],
     tests_require=["pytest"],
     classifiers=[
@@ -0,0 +1,109 @@
+"""
+File: _attachment_cache.py
+--------------------------
+This module contains the on-disk cache for downloaded attachment data.
+
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Callable, Optional
+
+
+class AttachmentCache(object):
+    """
+    An on-disk cache of attachment data, stored as one file per attachment
+    under cache_dir/<message id>/<part id>.
+
+    Gmail hands out a new attachment id every time a message is fetched, so
+    entries are keyed by the id of the MIME part instead, which (like the
+    message itself) never changes.
+
+    Args:
+        cache_dir: The directory to store cached attachments in. Created if it
+            does not exist.
+
+    Attributes:
+        cache_dir (str): The directory cached attachments are stored in.
+
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, msg_id: str, part_id: str) -> str:
+        return os.path.join(self.cache_dir, msg_id, part_id)
+
+    def get(self, msg_id: str, part_id: str) -> Optional[bytes]:
+        """
+        Retrieves cached attachment data.
+
+        Args:
+            msg_id: The id of the message the attachment belongs to.
+            part_id: The id of the MIME part of the attachment.
+
+        Returns:
+            The raw data of the file, or None if it is not cached.
+
+        """
+
+        try:
+            with open(self._path(msg_id, part_id), 'rb') as f:
+                return f.read()
+
+        except FileNotFoundError:
+            return None
+
+    def put(self, msg_id: str, part_id: str, data: bytes) -> None:
+        """
+        Stores attachment data in the cache.
+
+        Args:
+            msg_id: The id of the message the attachment belongs to.
+            part_id: The id of the MIME part of the attachment.
+            data: The raw data of the file.
+
+        """
+
+        self._put(msg_id, part_id, lambda f: f.write(data))
+
+    def put_file(self, msg_id: str, part_id: str, src_path: str) -> None:
+        """
+        Stores attachment data already written to a file in the cache.
+
+        Args:
+            msg_id: The id of the message the attachment belongs to.
+            part_id: The id of the MIME part of the attachment.
+            src_path: The path of the file holding the raw data.
+
+        """
+
+        def copy(f):
+            with open(src_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+
+        self._put(msg_id, part_id, copy)
+
+    def _put(
+        self,
+        msg_id: str,
+        part_id: str,
+        write: Callable[['io.BufferedWriter'], None]
+    ) -> None:
+        msg_dir = os.path.join(self.cache_dir, msg_id)
+        os.makedirs(msg_dir, exist_ok=True)
+
+        # Write to a temporary file and move it into place, so that readers
+        # (including other threads) never see a partially written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=msg_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+
+            os.replace(tmp_path, self._path(msg_id, part_id))
+
+        except BaseException:
+            os.remove(tmp_path)
+            raise
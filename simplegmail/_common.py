@@ -0,0 +1,17 @@
+"""
+File: _common.py
+----------------
+This module contains the settings and imports shared by the modules that make
+requests to the Gmail API.
+
+"""
+
+try:
+    import pybase64 as base64
+except ImportError:  # pybase64 is an optional, SIMD-accelerated drop-in
+    import base64
+
+
+# Number of times a read request is retried, with exponential backoff, when
+# Gmail responds with a rate limit or server error.
+NUM_RETRIES = 5
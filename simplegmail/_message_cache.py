@@ -0,0 +1,123 @@
+"""
+File: _message_cache.py
+-----------------------
+This module contains the on-disk cache for retrieved message data.
+
+"""
+
+import json
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+
+class MessageCache(object):
+    """
+    An on-disk cache of the full JSON of retrieved messages, stored in a
+    SQLite database.
+
+    The content of a Gmail message never changes once it exists, but its
+    labels do, so callers are expected to refresh the labels of cached
+    messages (which only needs a small 'minimal' format request).
+
+    Args:
+        path: The path of the database file. Created if it does not exist.
+
+    Attributes:
+        path (str): The path of the database file.
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        # The connection is shared by the threads retrieving messages in
+        # parallel, so its use is serialized.
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection to the database, opening it (and creating the
+        table) if it is not open. Must be called with the lock held.
+
+        Returns:
+            The connection.
+
+        """
+
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS messages '
+                    '(id TEXT PRIMARY KEY, message BLOB NOT NULL)'
+                )
+
+        return self._conn
+
+    def close(self) -> None:
+        """
+        Closes the connection to the database. The cache remains usable; the
+        connection is reopened as needed.
+
+        """
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_many(self, msg_ids: List[str]) -> Dict[str, dict]:
+        """
+        Retrieves cached messages.
+
+        Args:
+            msg_ids: The ids of the messages to look up.
+
+        Returns:
+            A dict mapping the ids of the messages that are cached to their
+            JSON.
+
+        """
+
+        if not msg_ids:
+            return {}
+
+        placeholders = ', '.join('?' * len(msg_ids))
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT id, message FROM messages '
+                f'WHERE id IN ({placeholders})',
+                msg_ids
+            ).fetchall()
+
+        return {
+            msg_id: json.loads(zlib.decompress(data)) for msg_id, data in rows
+        }
+
+    def put_many(self, messages: List[dict]) -> None:
+        """
+        Stores messages in the cache.
+
+        Args:
+            messages: The JSON of the messages, as returned by the Gmail API.
+
+        """
+
+        rows = [
+            (message['id'], zlib.compress(json.dumps(message).encode()))
+            for message in messages
+        ]
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO messages (id, message) '
+                    'VALUES (?, ?)',
+                    rows
+                )
@@ -5,9 +5,82 @@ This module contains the implementation of the Attachment object.
 
 """
 
-import base64  # for base64.urlsafe_b64decode
-import os      # for os.path.exists
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os      # for os.open
+import threading
+from typing import Callable, List, Optional
+
+from httplib2 import Http
+
+from simplegmail._common import NUM_RETRIES, base64
+
+
+# The number of base64 characters decoded at a time when downloading straight
+# to a file. A multiple of 4, so every chunk decodes on its own.
+_DECODE_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _open_for_write(filepath: str, overwrite: bool) -> 'io.BufferedWriter':
+    """
+    Opens a file for binary writing.
+
+    Checking for an existing file and creating it is a single call, so a file
+    created in the meantime cannot be overwritten by accident.
+
+    Args:
+        filepath: The path of the file to open.
+        overwrite: Whether to overwrite an existing file.
+
+    Returns:
+        The opened file.
+
+    Raises:
+        FileExistsError: if the file exists and overwrite is not set to True.
+
+    """
+
+    flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+    flags |= os.O_TRUNC if overwrite else os.O_EXCL
+    try:
+        fd = os.open(filepath, flags, 0o666)
+    except FileExistsError:
+        raise FileExistsError(
+            f"Cannot overwrite file '{filepath}'. Use overwrite=True if "
+            f"you would like to overwrite the file."
+        )
+
+    return os.fdopen(fd, 'wb')
+
+
+def _write_file(
+    filepath: str,
+    overwrite: bool,
+    write: Callable[['io.BufferedWriter'], None]
+) -> None:
+    """
+    Opens a file for binary writing and writes to it with the given function.
+    The file is opened first, so an existing file is refused before any data
+    is downloaded, and it is removed if writing fails partway.
+
+    Args:
+        filepath: The path of the file to write.
+        overwrite: Whether to overwrite an existing file.
+        write: Called with the opened file to write its contents.
+
+    Raises:
+        FileExistsError: if the file exists and overwrite is not set to True.
+
+    """
+
+    f = _open_for_write(filepath, overwrite)
+    try:
+        with f:
+            write(f)
+
+    except BaseException:
+        os.remove(filepath)
+        raise
+
 
 class Attachment(object):
     """
@@ -22,6 +95,14 @@ class Attachment(object):
         filename: The filename associated with the attachment.
         filetype: The mime type of the file.
         data: The raw data of the file. Default None.
+        creds: The OAuth credentials of the account, used to open a separate
+            connection per thread in download_many(). Default None.
+        attachments_resource: The service's users().messages().attachments()
+            resource, shared between attachments. Default None, which
+            resolves it from the service on first download.
+        part_id: The id of the MIME part of the attachment. Default None.
+        cache: The cache to read downloaded data from and store it in.
+            Default None, which disables caching.
 
     Attributes:
         _service (googleapiclient.discovery.Resource): The Gmail service object.
@@ -31,9 +112,20 @@ class Attachment(object):
         filename (str): The filename associated with the attachment.
         filetype (str): The mime type of the file.
         data (bytes): The raw data of the file.
+        creds (oauth2client.client.OAuth2Credentials): The OAuth credentials
+            of the account.
+        _attachments_resource (googleapiclient.discovery.Resource): The
+            attachments resource requests are built from.
+        part_id (str): The id of the MIME part of the attachment.
+        _cache (AttachmentCache): The cache of downloaded data.
 
     """
-    
+
+    # Bulk fetches can create many attachments, so skip the per-instance dict.
+    __slots__ = ('_service', 'user_id', 'msg_id', 'id', 'filename',
+                 'filetype', 'data', 'creds', '_attachments_resource',
+                 'part_id', '_cache')
+
     def __init__(
         self,
         service: 'googleapiclient.discovery.Resource',
@@ -42,7 +134,13 @@ class Attachment(object):
         att_id: str,
         filename: str,
         filetype: str,
-        data: Optional[bytes] = None
+        data: Optional[bytes] = None,
+        creds: Optional['oauth2client.client.OAuth2Credentials'] = None,
+        attachments_resource: Optional[
+            'googleapiclient.discovery.Resource'
+        ] = None,
+        part_id: Optional[str] = None,
+        cache: Optional['simplegmail._attachment_cache.AttachmentCache'] = None
     ) -> None:
         self._service = service
         self.user_id = user_id
@@ -51,6 +149,67 @@ class Attachment(object):
         self.filename = filename
         self.filetype = filetype
         self.data = data
+        self.creds = creds
+        self._attachments_resource = attachments_resource
+        self.part_id = part_id
+        self._cache = cache
+
+    @classmethod
+    def download_many(
+        cls,
+        attachments: List['Attachment'],
+        max_workers: int = 16
+    ) -> None:
+        """
+        Downloads the data for several attachments concurrently. Attachments
+        whose data already exists are skipped.
+
+        Args:
+            attachments: The attachments to download.
+            max_workers: The maximum number of concurrent downloads. Default
+                16.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        pending = [attm for attm in attachments if attm.data is None]
+
+        # Without credentials there is no way to give each thread its own
+        # connection, so fall back to downloading one at a time.
+        if len(pending) <= 1 or any(attm.creds is None for attm in pending):
+            for attm in pending:
+                attm.download()
+
+            return
+
+        local = threading.local()
+        https = []
+
+        def thread_download(attm):
+            # httplib2 connections are not thread-safe, so each worker thread
+            # authorizes and reuses its own.
+            if not hasattr(local, 'http'):
+                local.http = attm.creds.authorize(Http())
+                https.append(local.http)
+
+            attm.data = attm._fetch_data(local.http)
+
+        num_workers = min(max_workers, len(pending))
+        try:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = [executor.submit(thread_download, attm)
+                           for attm in pending]
+
+                for future in as_completed(futures):
+                    # Pass along any error
+                    future.result()
+
+        finally:
+            for http in https:
+                http.close()
 
     def download(self) -> None:
         """
@@ -65,12 +224,116 @@ class Attachment(object):
         if self.data is not None:
             return
 
-        res = self._service.users().messages().attachments().get(
+        self.data = self._fetch_data()
+
+    def _fetch_data(self, http: Optional[Http] = None) -> bytes:
+        """
+        Retrieves and decodes the data for the attachment, from the cache if
+        it has been downloaded before.
+
+        Args:
+            http: The connection to send the request on. Default None, which
+                uses the connection of the service object.
+
+        Returns:
+            The raw data of the file.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        use_cache = self._use_cache()
+        if use_cache:
+            data = self._cache.get(self.msg_id, self.part_id)
+            if data is not None:
+                return data
+
+        data = base64.urlsafe_b64decode(self._request_data(http))
+        if use_cache:
+            self._cache.put(self.msg_id, self.part_id, data)
+
+        return data
+
+    def _use_cache(self) -> bool:
+        return self._cache is not None and self.part_id is not None
+
+    def _request_data(self, http: Optional[Http] = None) -> str:
+        """
+        Requests the data for the attachment from Gmail.
+
+        Args:
+            http: The connection to send the request on. Default None, which
+                uses the connection of the service object.
+
+        Returns:
+            The data of the file, URL-safe base64 encoded.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        # Each step of the users().messages().attachments() chain builds a
+        # new Resource object, so it is resolved once and reused.
+        if self._attachments_resource is None:
+            self._attachments_resource = \
+                self._service.users().messages().attachments()
+
+        res = self._attachments_resource.get(
             userId=self.user_id, messageId=self.msg_id, id=self.id
-        ).execute()
+        ).execute(http=http, num_retries=NUM_RETRIES)
 
-        data = res['data']
-        self.data = base64.urlsafe_b64decode(data)
+        return res['data']
+
+    def download_to_file(
+        self,
+        filepath: Optional[str] = None,
+        overwrite: bool = False
+    ) -> None:
+        """
+        Downloads the attachment straight to a file, without keeping a copy of
+        the data on the attachment. The data is decoded into the file a chunk
+        at a time, so the decoded file is never held in memory whole.
+
+        Args:
+            filepath: where to save the attachment. Default None, which uses
+                the filename stored.
+            overwrite: whether to overwrite existing files. Default False.
+
+        Raises:
+            FileExistsError: if the call would overwrite an existing file and
+                overwrite is not set to True.
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        if filepath is None:
+            filepath = self.filename
+
+        use_cache = self._use_cache()
+        cached = None
+        if use_cache:
+            cached = self._cache.get(self.msg_id, self.part_id)
+
+        def write(f):
+            if cached is not None:
+                f.write(cached)
+                return
+
+            encoded = self._request_data()
+            for start in range(0, len(encoded), _DECODE_CHUNK_SIZE):
+                f.write(base64.urlsafe_b64decode(
+                    encoded[start:start + _DECODE_CHUNK_SIZE]
+                ))
+
+        _write_file(filepath, overwrite, write)
+
+        if use_cache and cached is None:
+            self._cache.put_file(self.msg_id, self.part_id, filepath)
 
     def save(
         self,
@@ -78,7 +341,9 @@ class Attachment(object):
         overwrite: bool = False
     ) -> None:
         """
-        Saves the attachment. Downloads file data if not downloaded.
+        Saves the attachment. Downloads file data if not downloaded. Use
+        download_to_file() to save a large attachment without keeping its data
+        in memory.
         
         Args:
             filepath: where to save the attachment. Default None, which uses 
@@ -94,15 +359,9 @@ class Attachment(object):
         if filepath is None:
             filepath = self.filename
 
-        if self.data is None:
+        def write(f):
             self.download()
-
-        if not overwrite and os.path.exists(filepath):
-            raise FileExistsError(
-                f"Cannot overwrite file '{filepath}'. Use overwrite=True if "
-                f"you would like to overwrite the file."
-            )
-
-        with open(filepath, 'wb') as f:
             f.write(self.data)
 
+        _write_file(filepath, overwrite, write)
+
@@ -6,34 +6,82 @@ attachments) and retrieving mail with the full suite of Gmail search options.
 
 """
 
-import base64
-from email.mime.audio       import MIMEAudio
-from email.mime.application import MIMEApplication
-from email.mime.base        import MIMEBase
-from email.mime.image       import MIMEImage
-from email.mime.multipart   import MIMEMultipart
-from email.mime.text        import MIMEText
+from concurrent.futures import ThreadPoolExecutor
+from email.generator import BytesGenerator
+from email.message import EmailMessage, MIMEPart
+from email.utils import parsedate_to_datetime
+from functools import partial
 import html
-import math
+import io
 import mimetypes
 import os
+import queue
+import random
 import re
 import threading
-from typing import List, Optional
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from bs4 import BeautifulSoup
-import dateutil.parser as parser
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 from httplib2 import Http
+import lxml.html
 from oauth2client import client, file, tools
 from oauth2client.clientsecrets import InvalidClientSecretsError
 
 from simplegmail import label
+from simplegmail._attachment_cache import AttachmentCache
+from simplegmail._common import NUM_RETRIES, base64
+from simplegmail._message_cache import MessageCache
 from simplegmail.attachment import Attachment
 from simplegmail.label import Label
 from simplegmail.message import Message
 
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup
+    orjson = None
+
+
+class _OrjsonModel(JsonModel):
+    """
+    A JsonModel that parses API responses with orjson, which is much faster
+    than the json module on the long base64 strings in message bodies.
+
+    """
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().deserialize(content)
+
+        if self._data_wrapper and 'data' in body:
+            body = body['data']
+
+        return body
+
+
+class _BytesGenerator(BytesGenerator):
+    """
+    A BytesGenerator that writes base64 encoded bodies, which are already
+    split into lines, in one piece. The base class writes every line
+    separately, which dominates the time to serialize large attachments.
+
+    """
+
+    def _handle_text(self, msg):
+        if (msg.get('content-transfer-encoding') == 'base64'
+                and self.policy.linesep == '\n'):
+            self.write(msg.get_payload())
+        else:
+            super()._handle_text(msg)
+
+    # Bodies are written through this alias, which has to be rebound.
+    _writeBody = _handle_text
+
 
 class Gmail(object):
     """
@@ -45,18 +93,42 @@ class Gmail(object):
             call).
         access_type: Whether to request a refresh token for usage without a
             user necessarily present. Either 'online' or 'offline'.
+        cache_dir: A directory to cache retrieved messages and downloaded
+            attachment data in, so that they are only downloaded once (the
+            labels of cached messages are still refreshed). Default None,
+            which disables caching.
 
     Attributes:
         client_secret_file (str): The name of the user's client secret file.
+        cache_dir (str): The directory messages and attachment data are cached
+            in.
         service (googleapiclient.discovery.Resource): The Gmail service object.
 
     """
 
     # Allow Gmail to read and write emails, and access settings like aliases.
-    _SCOPES = [
+    _SCOPES = (
         'https://www.googleapis.com/auth/gmail.modify',
         'https://www.googleapis.com/auth/gmail.settings.basic'
-    ]
+    )
+
+    # The maximum number of calls Gmail accepts in a single batch request.
+    _BATCH_SIZE = 100
+
+    # The maximum number of message references Gmail returns per page.
+    _MAX_PAGE_SIZE = 500
+
+    # The number of batches of messages retrieved concurrently, kept low to
+    # avoid throttling.
+    _MAX_THREADS = 4
+
+    # Extracts the address from a sender of the form 'Name <address>'.
+    _SENDER_ADDR_RE = re.compile(r'.+\s<(?P<addr>.+@.+\..+)>')
+
+    # The parsed Gmail API discovery document, shared by all instances (such
+    # as the per-thread ones used to retrieve messages) once the first
+    # service has been built.
+    _discovery_doc = None
 
     # If you don't have a client secret file, follow the instructions at:
     # https://developers.google.com/gmail/api/quickstart/python
@@ -68,10 +140,27 @@ class Gmail(object):
         creds_file: str = 'gmail_token.json',
         access_type: str = 'offline',
         noauth_local_webserver: bool = False,
+        cache_dir: Optional[str] = None,
         _creds: Optional[client.OAuth2Credentials] = None,
     ) -> None:
         self.client_secret_file = client_secret_file
         self.creds_file = creds_file
+        self.cache_dir = cache_dir
+        self._attachment_cache = (
+            AttachmentCache(cache_dir) if cache_dir else None
+        )
+        self._message_cache = (
+            MessageCache(os.path.join(cache_dir, 'messages.sqlite'))
+            if cache_dir else None
+        )
+        self._labels_cache: Dict[str, Dict[str, Label]] = {}
+        self._alias_cache: Dict[Tuple[str, str], dict] = {}
+
+        # Worker threads (and their Gmail objects) used to retrieve messages
+        # in parallel. Created on first use and kept until close().
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread_local = threading.local()
+        self._thread_gmails: List['Gmail'] = []
 
         try:
             # The file gmail_token.json stores the user's access and refresh
@@ -98,10 +187,20 @@ class Gmail(object):
                 flags = tools.argparser.parse_args(args)
                 self.creds = tools.run_flow(flow, store, flags)
 
-            self._service = build(
-                'gmail', 'v1', http=self.creds.authorize(Http()),
-                cache_discovery=False
-            )
+            # Kept so that requests can be sent on this object's connection
+            # without going through the service, as when it downloads
+            # attachments for another Gmail object.
+            self._http = self.creds.authorize(Http())
+            self._service = self._build_service(self._http)
+
+            # Every step of a users().messages() chain builds a new resource
+            # from the discovery document, which takes over a millisecond,
+            # so the resources used for requests are built once.
+            self._messages_resource = self._service.users().messages()
+            self._labels_resource = self._service.users().labels()
+
+            # Shared by all attachments retrieved through this object.
+            self._attachments_resource = self._messages_resource.attachments()
 
         except InvalidClientSecretsError:
             raise FileNotFoundError(
@@ -112,15 +211,65 @@ class Gmail(object):
                 "follow the instructions listed there."
             )
 
+    def _build_service(
+        self,
+        http: Http
+    ) -> 'googleapiclient.discovery.Resource':
+        """
+        Builds a new Gmail service object that sends its requests on the given
+        connection. httplib2 connections are not thread-safe, so requests made
+        concurrently each need their own connection.
+
+        Args:
+            http: The authorized connection to send requests on.
+
+        Returns:
+            The Gmail service object.
+
+        """
+
+        model = _OrjsonModel() if orjson else None
+        if Gmail._discovery_doc is None:
+            service = build(
+                'gmail', 'v1', http=http, cache_discovery=False, model=model
+            )
+            Gmail._discovery_doc = service._rootDesc
+            return service
+
+        return build_from_document(
+            Gmail._discovery_doc, http=http, model=model
+        )
+
     @property
     def service(self) -> 'googleapiclient.discovery.Resource':
-        # Since the token is only used through calls to the service object,
-        # this ensure that the token is always refreshed before use.
-        if self.creds.access_token_expired:
-            self.creds.refresh(Http())
-
+        # Requests are also made through resources cached from the service,
+        # so the token is not checked here. Every request is sent on an Http
+        # object authorized with the credentials, which refreshes an expired
+        # token and resends the request when it is rejected with a 401.
         return self._service
 
+    def close(self) -> None:
+        """
+        Stops the worker threads used to retrieve messages in parallel and
+        closes all open connections, including the message cache's. The
+        object remains usable; threads and connections are reopened as
+        needed.
+
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        for gmail in self._thread_gmails:
+            gmail._service.close()
+
+        self._thread_gmails = []
+        self._service.close()
+
+        if self._message_cache is not None:
+            self._message_cache.close()
+
     def send_message(
         self,
         sender: str,
@@ -168,7 +317,7 @@ class Gmail(object):
         )
 
         try:
-            req = self.service.users().messages().send(userId='me', body=msg)
+            req = self._messages_resource.send(userId='me', body=msg)
             res = req.execute()
             return self._build_message_from_ref(user_id, res, 'reference')
 
@@ -206,10 +355,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.INBOX)
+        labels = list(labels or []) + [label.INBOX]
         return self.get_unread_messages(user_id, labels, query)
 
     def get_starred_messages(
@@ -244,10 +390,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.STARRED)
+        labels = list(labels or []) + [label.STARRED]
         return self.get_messages(user_id, labels, query, attachments,
                                  include_spam_trash)
 
@@ -283,10 +426,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.IMPORTANT)
+        labels = list(labels or []) + [label.IMPORTANT]
         return self.get_messages(user_id, labels, query, attachments,
                                  include_spam_trash)
 
@@ -322,10 +462,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.UNREAD)
+        labels = list(labels or []) + [label.UNREAD]
         return self.get_messages(user_id, labels, query, attachments,
                                  include_spam_trash)
 
@@ -361,10 +498,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.DRAFT)
+        labels = list(labels or []) + [label.DRAFT]
         return self.get_messages(user_id, labels, query, attachments,
                                  include_spam_trash)
 
@@ -400,10 +534,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.SENT)
+        labels = list(labels or []) + [label.SENT]
         return self.get_messages(user_id, labels, query, attachments,
                                  include_spam_trash)
 
@@ -438,10 +569,7 @@ class Gmail(object):
 
         """
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.TRASH)
+        labels = list(labels or []) + [label.TRASH]
         return self.get_messages(user_id, labels, query, attachments, True)
 
     def get_spam_messages(
@@ -475,10 +603,7 @@ class Gmail(object):
         """
 
 
-        if labels is None:
-            labels = []
-
-        labels.append(label.SPAM)
+        labels = list(labels or []) + [label.SPAM]
         return self.get_messages(user_id, labels, query, attachments, True)
 
     def get_messages(
@@ -516,41 +641,158 @@ class Gmail(object):
         if labels is None:
             labels = []
 
-        labels_ids = [
-            lbl.id if isinstance(lbl, Label) else lbl for lbl in labels
-        ]
+        # Labels may be given as Label objects or as label ID strings.
+        labels_ids = [getattr(lbl, 'id', lbl) for lbl in labels]
 
         try:
-            response = self.service.users().messages().list(
-                userId=user_id,
-                q=query,
-                labelIds=labels_ids,
-                includeSpamTrash=include_spam_trash
-            ).execute()
+            response = self._list_messages_page(
+                self._messages_resource, user_id, query, labels_ids,
+                include_spam_trash
+            )
 
             message_refs = []
             if 'messages' in response:  # ensure request was successful
                 message_refs.extend(response['messages'])
 
-            while 'nextPageToken' in response:
-                page_token = response['nextPageToken']
-                response = self.service.users().messages().list(
-                    userId=user_id,
-                    q=query,
-                    labelIds=labels_ids,
-                    includeSpamTrash=include_spam_trash,
-                    pageToken=page_token
-                ).execute()
+            if 'nextPageToken' not in response:
+                return self._get_messages_from_refs(user_id, message_refs,
+                                                    attachments)
+
+            # List the remaining pages in the background, so that messages
+            # are retrieved while later pages are still being listed.
+            pages = queue.Queue()
+            stop = threading.Event()
+            lister = threading.Thread(
+                target=self._list_remaining_pages,
+                args=(pages, stop, response['nextPageToken'], user_id, query,
+                      labels_ids, include_spam_trash),
+                daemon=True
+            )
+            lister.start()
 
-                message_refs.extend(response['messages'])
+            try:
+                messages = []
+                while message_refs is not None:
+                    messages.extend(self._iter_messages_from_refs(
+                        user_id, message_refs, attachments
+                    ))
+
+                    message_refs = pages.get()
+                    if isinstance(message_refs, Exception):
+                        raise message_refs
 
-            return self._get_messages_from_refs(user_id, message_refs,
-                                                attachments)
+                return messages
+
+            finally:
+                # If retrieval failed, the rest of the mailbox must not go on
+                # being listed for nothing.
+                stop.set()
+                lister.join()
 
         except HttpError as error:
             # Pass along the error
             raise error
 
+    def _list_messages_page(
+        self,
+        messages_resource: 'googleapiclient.discovery.Resource',
+        user_id: str,
+        query: str,
+        labels_ids: List[str],
+        include_spam_trash: bool,
+        page_token: Optional[str] = None
+    ) -> dict:
+        """
+        Lists a single page of message references.
+
+        Args:
+            messages_resource: The users().messages() resource to list with.
+            user_id: The user's email address.
+            query: A Gmail query to match.
+            labels_ids: Label IDs messages must match.
+            include_spam_trash: Whether to include messages from spam or trash.
+            page_token: The token of the page to list. Default None, the first
+                page.
+
+        Returns:
+            The response, with the message references under 'messages' (if
+            there are any) and the token of the next page under
+            'nextPageToken' (if there is one).
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        return messages_resource.list(
+            userId=user_id,
+            q=query,
+            labelIds=labels_ids,
+            includeSpamTrash=include_spam_trash,
+            maxResults=self._MAX_PAGE_SIZE,
+            pageToken=page_token,
+            fields='messages(id,threadId),nextPageToken'
+        ).execute(num_retries=NUM_RETRIES)
+
+    def _list_remaining_pages(
+        self,
+        pages: queue.Queue,
+        stop: threading.Event,
+        page_token: str,
+        user_id: str,
+        query: str,
+        labels_ids: List[str],
+        include_spam_trash: bool
+    ) -> None:
+        """
+        Lists the message references of every page from page_token onwards,
+        using a separate connection so it can run in its own thread.
+
+        The references of each page are put on the pages queue, followed by
+        None once all pages are listed. If an error occurs, it is put on the
+        queue instead. Listing ends early, without either, once stop is set.
+
+        Args:
+            pages: The queue to put the message references on.
+            stop: Set by the consuming thread when it no longer needs pages.
+            page_token: The token of the first page to list.
+            user_id: The user's email address.
+            query: A Gmail query to match.
+            labels_ids: Label IDs messages must match.
+            include_spam_trash: Whether to include messages from spam or trash.
+
+        """
+
+        service = None
+        try:
+            service = self._build_service(self.creds.authorize(Http()))
+            messages_resource = service.users().messages()
+            while page_token:
+                if stop.is_set():
+                    return
+
+                response = self._list_messages_page(
+                    messages_resource, user_id, query, labels_ids,
+                    include_spam_trash, page_token
+                )
+
+                if 'messages' in response:  # the last page may be empty
+                    pages.put(response['messages'])
+
+                page_token = response.get('nextPageToken')
+
+        except Exception as error:
+            # Pass the error along to the consuming thread
+            pages.put(error)
+
+        else:
+            pages.put(None)
+
+        finally:
+            if service is not None:
+                service.close()
+
     def list_labels(self, user_id: str = 'me') -> List[Label]:
         """
         Retrieves all labels for the specified user.
@@ -572,9 +814,9 @@ class Gmail(object):
         """
 
         try:
-            res = self.service.users().labels().list(
+            res = self._labels_resource.list(
                 userId=user_id
-            ).execute()
+            ).execute(num_retries=NUM_RETRIES)
 
         except HttpError as error:
             # Pass along the error
@@ -616,7 +858,7 @@ class Gmail(object):
         }
 
         try:
-            res = self.service.users().labels().create(
+            res = self._labels_resource.create(
                 userId=user_id,
                 body=body
             ).execute()
@@ -626,6 +868,7 @@ class Gmail(object):
             raise error
 
         else:
+            self.invalidate_labels_cache(user_id)
             return Label(res['name'], res['id'])
 
     def delete_label(self, label: Label, user_id: str = 'me') -> None:
@@ -644,7 +887,7 @@ class Gmail(object):
         """
 
         try:
-            self.service.users().labels().delete(
+            self._labels_resource.delete(
                 userId=user_id,
                 id=label.id
             ).execute()
@@ -653,6 +896,69 @@ class Gmail(object):
             # Pass along the error
             raise error
 
+        else:
+            self.invalidate_labels_cache(user_id)
+
+    def invalidate_labels_cache(self, user_id: Optional[str] = None) -> None:
+        """
+        Clears the cached labels used to resolve the label IDs of retrieved
+        messages. This is done automatically by create_label() and
+        delete_label(), but is needed if labels are changed elsewhere.
+
+        Args:
+            user_id: The user's email address whose labels to clear. Default
+                None, which clears the labels of all users.
+
+        """
+
+        if user_id is None:
+            self._labels_cache.clear()
+        else:
+            self._labels_cache.pop(user_id, None)
+
+    def invalidate_alias_cache(self, user_id: Optional[str] = None) -> None:
+        """
+        Clears the cached alias info (such as signatures) used when sending
+        messages. This is needed if an alias is changed elsewhere while this
+        object is in use.
+
+        Args:
+            user_id: The user's email address whose alias info to clear.
+                Default None, which clears the alias info of all users.
+
+        """
+
+        if user_id is None:
+            self._alias_cache.clear()
+        else:
+            for key in [key for key in self._alias_cache if key[0] == user_id]:
+                del self._alias_cache[key]
+
+    def _get_labels_map(self, user_id: str = 'me') -> Dict[str, Label]:
+        """
+        Retrieves the labels for the specified user, keyed by label ID. The
+        labels are only requested from the API the first time.
+
+        Args:
+            user_id: The user's email address. By default, the authenticated
+                user.
+
+        Returns:
+            A dict mapping label IDs to Label objects.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        if user_id not in self._labels_cache:
+            self._labels_cache[user_id] = {
+                x.id: x for x in self.list_labels(user_id=user_id)
+            }
+
+        return self._labels_cache[user_id]
+
     def _get_messages_from_refs(
         self,
         user_id: str,
@@ -685,48 +991,309 @@ class Gmail(object):
 
         """
 
+        return list(self._iter_messages_from_refs(
+            user_id, message_refs, attachments, parallel
+        ))
+
+    def _iter_messages_from_refs(
+        self,
+        user_id: str,
+        message_refs: List[dict],
+        attachments: str = 'reference',
+        parallel: bool = True
+    ) -> Iterator[Message]:
+        """
+        Retrieves the actual messages from a list of references, yielding
+        each batch of messages, in order, as soon as it is retrieved.
+
+        Args:
+            user_id: The account the messages belong to.
+            message_refs: A list of message references with keys id, threadId.
+            attachments: Accepted values are 'ignore' which completely ignores
+                all attachments, 'reference' which includes attachment
+                information but does not download the data, and 'download'
+                which downloads the attachment data to store locally. Default
+                'reference'.
+            parallel: Whether to retrieve messages in parallel. Default true.
+
+        Yields:
+            Message objects, in the order of message_refs.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
         if not message_refs:
-            return []
+            return
+
+        # Each batch request already carries up to _BATCH_SIZE messages, so
+        # threads only pay off when there are several batches to overlap.
+        if not parallel or len(message_refs) <= self._BATCH_SIZE:
+            raw_messages = self._get_raw_messages_batch(user_id, message_refs)
+            messages = self._build_messages(user_id, raw_messages, attachments)
+            if attachments == 'download':
+                self._download_attachments(messages)
+
+            yield from messages
+            return
+
+        # Each batch is a separate task, so a thread that finishes early
+        # picks up the next batch instead of waiting on a slow one.
+        batches = [
+            message_refs[i:i + self._BATCH_SIZE]
+            for i in range(0, len(message_refs), self._BATCH_SIZE)
+        ]
 
-        if not parallel:
-            return [self._build_message_from_ref(user_id, ref, attachments)
-                    for ref in message_refs]
+        def thread_download_batch(batch_refs):
+            raw_messages = self._thread_gmail()._get_raw_messages_batch(
+                user_id, batch_refs
+            )
 
-        max_num_threads = 12  # empirically chosen, prevents throttling
-        target_msgs_per_thread = 10  # empirically chosen
-        num_threads = min(
-            math.ceil(len(message_refs) / target_msgs_per_thread),
-            max_num_threads
-        )
-        batch_size = math.ceil(len(message_refs) / num_threads)
-        message_lists = [None] * num_threads
+            # The messages are built with this object rather than the
+            # thread's, since the caller goes on to use them while the
+            # thread's connection serves other batches.
+            return self._build_messages(user_id, raw_messages, attachments)
+
+        # map() submits every batch up front and hands back the results in
+        # the order of the batches, dropping its reference to each one as it
+        # is handed back.
+        for batch_messages in self._get_executor().map(thread_download_batch,
+                                                       batches):
+            if attachments == 'download':
+                # Downloaded from this thread, as the worker threads must not
+                # wait on tasks queued behind their own.
+                self._download_attachments(batch_messages)
+
+            yield from batch_messages
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Returns the pool of worker threads used to retrieve messages and
+        attachments in parallel, creating it on first use.
+
+        Returns:
+            The executor.
+
+        """
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._MAX_THREADS)
 
-        def thread_download_batch(thread_num):
-            gmail = Gmail(_creds=self.creds)
+        return self._executor
+
+    def _thread_gmail(self) -> 'Gmail':
+        """
+        Returns the Gmail object of the current worker thread, creating it on
+        first use. httplib2 connections are not thread-safe, so each thread
+        uses its own Gmail object, which it keeps (along with its open
+        connection) for every task it handles across calls.
+
+        Returns:
+            The Gmail object of the current thread.
+
+        """
+
+        local = self._thread_local
+        if not hasattr(local, 'gmail'):
+            local.gmail = Gmail(_creds=self.creds)
+            local.gmail.cache_dir = self.cache_dir
+            local.gmail._attachment_cache = self._attachment_cache
+            local.gmail._message_cache = self._message_cache
+            local.gmail._labels_cache = self._labels_cache
+            self._thread_gmails.append(local.gmail)
+
+        return local.gmail
+
+    def _download_attachments(self, messages: List[Message]) -> None:
+        """
+        Downloads the data of the messages' attachments that do not have it
+        yet, on the worker threads, each using its own connection.
 
-            start = thread_num * batch_size
-            end = min(len(message_refs), (thread_num + 1) * batch_size)
-            message_lists[thread_num] = [
-                gmail._build_message_from_ref(
-                    user_id, message_refs[i], attachments
+        Args:
+            messages: The messages to download the attachments of.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        pending = [
+            attm for msg in messages for attm in msg.attachments
+            if attm.data is None
+        ]
+        if not pending:
+            return
+
+        def thread_download(attm):
+            attm.data = attm._fetch_data(self._thread_gmail()._http)
+
+        # Consuming the results passes along any error.
+        for _ in self._get_executor().map(thread_download, pending):
+            pass
+
+    def _get_raw_messages_batch(
+        self,
+        user_id: str,
+        message_refs: List[dict]
+    ) -> List[dict]:
+        """
+        Retrieves the JSON of the messages from a list of references, bundling
+        up to _BATCH_SIZE message requests into each HTTP request.
+
+        Args:
+            user_id: The account the messages belong to.
+            message_refs: A list of message references with keys id, threadId.
+
+        Returns:
+            A list of message JSON, in the same order as message_refs.
+
+        Raises:
+            googleapiclient.errors.HttpError: There was an error executing the
+                HTTP request.
+
+        """
+
+        # Responses are slotted by their index in message_refs, so the order
+        # of the returned messages does not depend on the order in which the
+        # batch callbacks fire.
+        responses = [None] * len(message_refs)
+        errors = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[int(request_id)] = exception
+            else:
+                responses[int(request_id)] = response
+
+        service = self.service
+        for start in range(0, len(message_refs), self._BATCH_SIZE):
+            end = min(len(message_refs), start + self._BATCH_SIZE)
+
+            # The content of a message never changes, so for cached messages
+            # only the current labels are requested.
+            cached = {}
+            if self._message_cache is not None:
+                cached = self._message_cache.get_many(
+                    [ref['id'] for ref in message_refs[start:end]]
                 )
-                for i in range(start, end)
-            ]
 
-            gmail.service.close()
+            pending = range(start, end)
+            for attempt in range(NUM_RETRIES + 1):
+                if attempt:
+                    # Back off before resending the throttled requests
+                    time.sleep(random.random() * 2 ** attempt)
+
+                errors.clear()
+                batch = service.new_batch_http_request(callback=callback)
+                for i in pending:
+                    msg_id = message_refs[i]['id']
+                    batch.add(
+                        self._messages_resource.get(
+                            userId=user_id,
+                            id=msg_id,
+                            format='minimal' if msg_id in cached else 'full'
+                        ),
+                        request_id=str(i)
+                    )
+
+                try:
+                    batch.execute()
+                except HttpError as error:
+                    if not self._is_retryable_error(error):
+                        # Pass along the error
+                        raise error
+
+                    # The batch request itself was throttled or failed, so
+                    # every request in it is resent.
+                    errors.update((i, error) for i in pending)
+
+                if not errors:
+                    break
+
+                for error in errors.values():
+                    if not self._is_retryable_error(error):
+                        # Pass along the error
+                        raise error
+
+                pending = sorted(errors)
+
+            else:
+                # Pass along the error
+                raise errors[pending[0]]
+
+            if self._message_cache is not None:
+                fetched = []
+                for i in range(start, end):
+                    message = cached.get(responses[i]['id'])
+                    if message is None:
+                        fetched.append(responses[i])
+                    else:
+                        # Labels are omitted from the response if there are
+                        # none, so the cached ones must not be kept.
+                        message.pop('labelIds', None)
+                        message.update(responses[i])
+                        responses[i] = message
+
+                self._message_cache.put_many(fetched)
+
+        return responses
+
+    def _build_messages(
+        self,
+        user_id: str,
+        raw_messages: List[dict],
+        attachments: str = 'reference'
+    ) -> List[Message]:
+        """
+        Creates Message objects from the message JSON returned by the Gmail
+        API.
+
+        Args:
+            user_id: The account the messages belong to.
+            raw_messages: The message resources returned from the Gmail API.
+            attachments: Accepted values are 'ignore' which completely ignores
+                all attachments, 'reference' which includes attachment
+                information but does not download the data, and 'download'
+                which also keeps any attachment data included in the JSON.
+                Default 'reference'.
 
-        threads = [
-            threading.Thread(target=thread_download_batch, args=(i,))
-            for i in range(num_threads)
+        Returns:
+            A list of Message objects, in the same order as raw_messages.
+
+        """
+
+        return [
+            self._build_message_from_raw_json(user_id, message, attachments)
+            for message in raw_messages
         ]
 
-        for t in threads:
-            t.start()
+    def _is_retryable_error(self, error: Exception) -> bool:
+        """
+        Determines whether a failed request is worth retrying, i.e., whether
+        it was rate limited or hit a transient server error.
+
+        Args:
+            error: The exception the request failed with.
+
+        Returns:
+            Whether the request should be retried.
+
+        """
 
-        for t in threads:
-            t.join()
+        if not isinstance(error, HttpError):
+            return False
 
-        return sum(message_lists, [])
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+
+        return status == 403 and any(
+            reason in error.content
+            for reason in (b'rateLimitExceeded', b'userRateLimitExceeded')
+        )
 
     def _build_message_from_ref(
         self,
@@ -758,180 +1325,236 @@ class Gmail(object):
 
         try:
             # Get message JSON
-            message = self.service.users().messages().get(
+            message = self._messages_resource.get(
                 userId=user_id, id=message_ref['id']
-            ).execute()
+            ).execute(num_retries=NUM_RETRIES)
 
         except HttpError as error:
             # Pass along the error
             raise error
 
         else:
-            msg_id = message['id']
-            thread_id = message['threadId']
-            label_ids = []
-            if 'labelIds' in message:
-                user_labels = {x.id: x for x in self.list_labels(user_id=user_id)}
-                label_ids = [user_labels[x] for x in message['labelIds']]
-            snippet = html.unescape(message['snippet'])
-
-            payload = message['payload']
-            headers = payload['headers']
-
-            # Get header fields (date, from, to, subject)
-            date = ''
-            sender = ''
-            recipient = ''
-            subject = ''
-            msg_hdrs = {}
-            cc = []
-            bcc = []
-            for hdr in headers:
-                if hdr['name'].lower() == 'date':
-                    try:
-                        date = str(parser.parse(hdr['value']).astimezone())
-                    except Exception:
-                        date = hdr['value']
-                elif hdr['name'].lower() == 'from':
-                    sender = hdr['value']
-                elif hdr['name'].lower() == 'to':
-                    recipient = hdr['value']
-                elif hdr['name'].lower() == 'subject':
-                    subject = hdr['value']
-                elif hdr['name'].lower() == 'cc':
-                    cc = hdr['value'].split(', ')
-                elif hdr['name'].lower() == 'bcc':
-                    bcc = hdr['value'].split(', ')
-
-                msg_hdrs[hdr['name']] = hdr['value']
-
-            parts = self._evaluate_message_payload(
-                payload, user_id, message_ref['id'], attachments
+            msg = self._build_message_from_raw_json(
+                user_id, message, attachments
             )
 
-            plain_msg = None
-            html_msg = None
-            attms = []
-            for part in parts:
-                if part['part_type'] == 'plain':
-                    if plain_msg is None:
-                        plain_msg = part['body']
-                    else:
-                        plain_msg += '\n' + part['body']
-                elif part['part_type'] == 'html':
-                    if html_msg is None:
-                        html_msg = part['body']
-                    else:
-                        html_msg += '<br/>' + part['body']
-                elif part['part_type'] == 'attachment':
-                    attm = Attachment(self.service, user_id, msg_id,
-                                      part['attachment_id'], part['filename'],
-                                      part['filetype'], part['data'])
-                    attms.append(attm)
-
-            return Message(
-                self.service,
-                self.creds,
-                user_id,
-                msg_id,
-                thread_id,
-                recipient,
-                sender,
-                subject,
-                date,
-                snippet,
-                plain_msg,
-                html_msg,
-                label_ids,
-                attms,
-                msg_hdrs,
-                cc,
-                bcc
-            )
+            if attachments == 'download':
+                self._download_attachments([msg])
+
+            return msg
+
+    def _build_message_from_raw_json(
+        self,
+        user_id: str,
+        message: dict,
+        attachments: str = 'reference'
+    ) -> Message:
+        """
+        Creates a Message object from the message JSON returned by the Gmail
+        API.
+
+        Attachment data that is not included in the JSON is not fetched here,
+        so that callers can download the attachments of many messages at once
+        with _download_attachments().
+
+        Args:
+            user_id: The username of the account the message belongs to.
+            message: The message resource returned from the Gmail API.
+            attachments: Accepted values are 'ignore' which completely ignores
+                all attachments, 'reference' which includes attachment
+                information but does not download the data, and 'download' which
+                also keeps any attachment data included in the JSON. Default
+                'reference'.
+
+        Returns:
+            The Message object.
+
+        """
+
+        msg_id = message['id']
+        thread_id = message['threadId']
+        label_ids = message.get('labelIds', [])
+        snippet = html.unescape(message['snippet'])
+
+        payload = message['payload']
+        headers = payload['headers']
+
+        # Get header fields (date, from, to, subject). Header names are case
+        # insensitive, and the last value wins if a header is repeated.
+        msg_hdrs = {hdr['name']: hdr['value'] for hdr in headers}
+        lower_hdrs = {hdr['name'].lower(): hdr['value'] for hdr in headers}
+
+        date = ''
+        if 'date' in lower_hdrs:
+            date = self._parse_date(lower_hdrs['date'])
+
+        sender = lower_hdrs.get('from', '')
+        recipient = lower_hdrs.get('to', '')
+        subject = lower_hdrs.get('subject', '')
+        cc = lower_hdrs['cc'].split(', ') if 'cc' in lower_hdrs else []
+        bcc = lower_hdrs['bcc'].split(', ') if 'bcc' in lower_hdrs else []
+
+        parts = self._evaluate_message_payload(payload, attachments)
+
+        # Collect the body parts and join them once at the end, rather
+        # than re-copying the accumulated body for every extra part.
+        plain_parts = []
+        html_parts = []
+        attms = []
+        for part in parts:
+            if part['part_type'] == 'plain':
+                plain_parts.append(part['body'])
+            elif part['part_type'] == 'html':
+                html_parts.append(part['body'])
+            elif part['part_type'] == 'attachment':
+                attm = Attachment(self.service, user_id, msg_id,
+                                  part['attachment_id'], part['filename'],
+                                  part['filetype'], part['data'], self.creds,
+                                  self._attachments_resource,
+                                  part['part_id'], self._attachment_cache)
+                attms.append(attm)
+
+        plain_msg = '\n'.join(plain_parts) if plain_parts else None
+        html_msg = '<br/>'.join(html_parts) if html_parts else None
+
+        return Message(
+            self.service,
+            self.creds,
+            user_id,
+            msg_id,
+            thread_id,
+            recipient,
+            sender,
+            subject,
+            date,
+            snippet,
+            plain_msg,
+            html_msg,
+            label_ids,
+            attms,
+            msg_hdrs,
+            cc,
+            bcc,
+            label_resolver=partial(self._get_labels_map, user_id)
+        )
+
+    def _parse_date(self, value: str) -> str:
+        """
+        Converts the value of a Date header to local time.
+
+        Args:
+            value: The value of the Date header.
+
+        Returns:
+            The date as a string in local time, or the value unchanged if it
+            cannot be parsed.
+
+        """
+
+        # Almost all Date headers follow RFC 2822, which the standard library
+        # parses much faster than dateutil. Anything else, including dates
+        # without a definite timezone, is left to dateutil as before.
+        try:
+            dt = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            dt = None
+
+        if dt is not None and dt.tzinfo is not None:
+            return str(dt.astimezone())
+
+        # Imported here, as it is only needed for unusual dates.
+        import dateutil.parser as parser
+
+        try:
+            return str(parser.parse(value).astimezone())
+        except Exception:
+            return value
 
     def _evaluate_message_payload(
         self,
         payload: dict,
-        user_id: str,
-        msg_id: str,
         attachments: str = 'reference'
     ) -> List[dict]:
         """
-        Recursively evaluates a message payload.
+        Evaluates a message payload and all of its nested parts.
 
         Args:
             payload: The message payload object (response from Gmail API).
-            user_id: The current account address (default 'me').
-            msg_id: The id of the message.
             attachments: Accepted values are 'ignore' which completely ignores
                 all attachments, 'reference' which includes attachment
                 information but does not download the data, and 'download' which
-                downloads the attachment data to store locally. Default
+                also decodes attachment data included in the payload. Default
                 'reference'.
 
         Returns:
             A list of message parts.
 
-        Raises:
-            googleapiclient.errors.HttpError: There was an error executing the
-                HTTP request.
-
         """
 
-        if 'attachmentId' in payload['body']:  # if it's an attachment
-            if attachments == 'ignore':
-                return []
+        parts = []
+
+        # Parts are evaluated with an explicit stack rather than recursively,
+        # and pushed in reverse so that they come off it in order.
+        stack = [payload]
+        while stack:
+            payload = stack.pop()
+            mime_type = payload['mimeType']
+            payload_body = payload['body']
+            att_id = payload_body.get('attachmentId')
+
+            if att_id is not None:  # if it's an attachment
+                if attachments == 'ignore':
+                    continue
+
+                filename = payload['filename']
+                if not filename:
+                    filename = 'unknown'
+
+                obj = {
+                    'part_type': 'attachment',
+                    'filetype': mime_type,
+                    'filename': filename,
+                    'attachment_id': att_id,
+                    'part_id': payload.get('partId'),
+                    'data': None
+                }
+
+                # Data not sent inline is downloaded afterwards, in bulk.
+                if attachments == 'download':
+                    data = payload_body.get('data')
+                    if data is not None:
+                        obj['data'] = base64.urlsafe_b64decode(data)
+
+                parts.append(obj)
+
+            elif mime_type == 'text/html':
+                data = payload_body['data']
+                data = base64.urlsafe_b64decode(data)
+                parser = lxml.html.HTMLParser(encoding='utf-8')
+                try:
+                    body = lxml.html.document_fromstring(
+                        data, parser=parser
+                    ).body
+                except lxml.etree.ParserError:  # the document is empty
+                    body = None
+
+                if body is None:
+                    body = ''
+                else:
+                    body = lxml.html.tostring(body, encoding='unicode')
 
-            att_id = payload['body']['attachmentId']
-            filename = payload['filename']
-            if not filename:
-                filename = 'unknown'
+                parts.append({ 'part_type': 'html', 'body': body })
 
-            obj = {
-                'part_type': 'attachment',
-                'filetype': payload['mimeType'],
-                'filename': filename,
-                'attachment_id': att_id,
-                'data': None
-            }
+            elif mime_type == 'text/plain':
+                data = payload_body['data']
+                data = base64.urlsafe_b64decode(data)
+                body = data.decode('UTF-8')
+                parts.append({ 'part_type': 'plain', 'body': body })
 
-            if attachments == 'reference':
-                return [obj]
+            elif mime_type.startswith('multipart'):
+                stack.extend(reversed(payload.get('parts', [])))
 
-            else:  # attachments == 'download'
-                if 'data' in payload['body']:
-                    data = payload['body']['data']
-                else:
-                    res = self.service.users().messages().attachments().get(
-                        userId=user_id, messageId=msg_id, id=att_id
-                    ).execute()
-                    data = res['data']
-
-                file_data = base64.urlsafe_b64decode(data)
-                obj['data'] = file_data
-                return [obj]
-
-        elif payload['mimeType'] == 'text/html':
-            data = payload['body']['data']
-            data = base64.urlsafe_b64decode(data)
-            body = BeautifulSoup(data, 'lxml', from_encoding='utf-8').body
-            return [{ 'part_type': 'html', 'body': str(body) }]
-
-        elif payload['mimeType'] == 'text/plain':
-            data = payload['body']['data']
-            data = base64.urlsafe_b64decode(data)
-            body = data.decode('UTF-8')
-            return [{ 'part_type': 'plain', 'body': body }]
-
-        elif payload['mimeType'].startswith('multipart'):
-            ret = []
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    ret.extend(self._evaluate_message_payload(part, user_id, msg_id,
-                                                              attachments))
-            return ret
-
-        return []
+        return parts
 
     def _create_message(
         self,
@@ -968,7 +1591,7 @@ class Gmail(object):
 
         """
 
-        msg = MIMEMultipart('mixed' if attachments else 'alternative')
+        msg = EmailMessage()
         msg['To'] = to
         msg['From'] = sender
         msg['Subject'] = subject
@@ -980,7 +1603,7 @@ class Gmail(object):
             msg['Bcc'] = ', '.join(bcc)
 
         if signature:
-            m = re.match(r'.+\s<(?P<addr>.+@.+\..+)>', sender)
+            m = self._SENDER_ADDR_RE.match(sender)
             address = m.group('addr') if m else sender
             account_sig = self._get_alias_info(address, user_id)['signature']
 
@@ -989,32 +1612,44 @@ class Gmail(object):
 
             msg_html += "<br /><br />" + account_sig
 
-        attach_plain = MIMEMultipart('alternative') if attachments else msg
-        attach_html = MIMEMultipart('related') if attachments else msg
-
         if msg_plain:
-            attach_plain.attach(MIMEText(msg_plain, 'plain'))
+            msg.set_content(msg_plain)
 
-        if msg_html:
-            attach_html.attach(MIMEText(msg_html, 'html'))
+            if msg_html:
+                msg.add_alternative(msg_html, subtype='html')
 
-        if attachments:
-            attach_plain.attach(attach_html)
-            msg.attach(attach_plain)
+        elif msg_html:
+            msg.set_content(msg_html, subtype='html')
 
+        if attachments:
             self._ready_message_with_attachments(msg, attachments)
 
+        # Only set_content() adds this header, so a message with attachments
+        # but no body would otherwise go without it.
+        if 'MIME-Version' not in msg:
+            msg['MIME-Version'] = '1.0'
+
+        # Boundaries are set up front, as otherwise the generator joins and
+        # searches the entire message (attachments included) to pick ones
+        # that do not occur in it.
+        for part in msg.walk():
+            if part.is_multipart():
+                part.set_boundary('=' * 15 + uuid.uuid4().hex + '==')
+
+        buf = io.BytesIO()
+        _BytesGenerator(buf, mangle_from_=False, policy=msg.policy).flatten(msg)
+
         return {
-            'raw': base64.urlsafe_b64encode(msg.as_string().encode()).decode()
+            'raw': base64.urlsafe_b64encode(buf.getbuffer()).decode()
         }
 
     def _ready_message_with_attachments(
         self,
-        msg: MIMEMultipart,
+        msg: EmailMessage,
         attachments: List[str]
     ) -> None:
         """
-        Converts attachment filepaths to MIME objects and adds them to msg.
+        Reads the attachment files and adds them to msg.
 
         Args:
             msg: The message to add attachments to.
@@ -1032,21 +1667,24 @@ class Gmail(object):
             with open(filepath, 'rb') as file:
                 raw_data = file.read()
 
-                attm: MIMEBase
-                if main_type == 'text':
-                    attm = MIMEText(raw_data.decode('UTF-8'), _subtype=sub_type)
-                elif main_type == 'image':
-                    attm = MIMEImage(raw_data, _subtype=sub_type)
-                elif main_type == 'audio':
-                    attm = MIMEAudio(raw_data, _subtype=sub_type)
-                elif main_type == 'application':
-                    attm = MIMEApplication(raw_data, _subtype=sub_type)
-                else:
-                    attm = MIMEBase(main_type, sub_type)
-                    attm.set_payload(raw_data)
-
             fname = os.path.basename(filepath)
+            if main_type == 'text':
+                msg.add_attachment(raw_data.decode('UTF-8'), subtype=sub_type,
+                                   filename=fname)
+                continue
+
+            # Equivalent to add_attachment(), but the data is base64 encoded
+            # in one call rather than line by line, which is several times
+            # faster for large files.
+            attm = MIMEPart()
+            attm['Content-Type'] = content_type
+            attm['Content-Transfer-Encoding'] = 'base64'
             attm.add_header('Content-Disposition', 'attachment', filename=fname)
+            attm.set_payload(base64.encodebytes(raw_data).decode('ascii'))
+
+            if msg.get_content_type() != 'multipart/mixed':
+                msg.make_mixed()
+
             msg.attach(attm)
 
     def _get_alias_info(
@@ -1084,12 +1722,16 @@ class Gmail(object):
                 alias is for (default "me").
 
         Returns:
-            The dict of alias info associated with the account.
+            The dict of alias info associated with the account. The info is
+            only requested from the API the first time.
 
         """
 
-        req =  self.service.users().settings().sendAs().get(
-                   sendAsEmail=send_as_email, userId=user_id)
+        key = (user_id, send_as_email)
+        if key not in self._alias_cache:
+            req =  self.service.users().settings().sendAs().get(
+                       sendAsEmail=send_as_email, userId=user_id)
+
+            self._alias_cache[key] = req.execute(num_retries=NUM_RETRIES)
 
-        res = req.execute()
-        return res
+        return self._alias_cache[key]
@@ -5,9 +5,8 @@ This module contains the implementation of the Message object.
 
 """
 
-from typing import List, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
 
-from httplib2 import Http
 from googleapiclient.errors import HttpError
 
 from simplegmail import label
@@ -39,6 +38,9 @@ class Message(object):
         headers: a dict of header values. Default {}
         cc: who the message was cc'd on the message.
         bcc: who the message was bcc'd on the message.
+        label_resolver: a function returning a dict of the account's labels by
+            id, used to turn label_ids into Label objects the first time they
+            are accessed. Default None (label_ids are kept as given).
 
     Attributes:
         _service (googleapiclient.discovery.Resource): the Gmail service object.
@@ -51,7 +53,7 @@ class Message(object):
         snippet (str): the snippet line for the message.
         plain (str): the plaintext contents of the message.
         html (str): the HTML contents of the message.
-        label_ids (List[str]): the ids of labels associated with this message.
+        label_ids (List[Label]): the labels associated with this message.
         attachments (List[Attachment]): a list of attachments for the message.
         headers (dict): a dict of header values.
         cc (List[str]): who the message was cc'd on the message.
@@ -77,7 +79,8 @@ class Message(object):
         attachments: Optional[List[Attachment]] = None,
         headers: Optional[dict] = None,
         cc: Optional[List[str]] = None,
-        bcc: Optional[List[str]] = None
+        bcc: Optional[List[str]] = None,
+        label_resolver: Optional[Callable[[], Dict[str, Label]]] = None
     ) -> None:
         self._service = service
         self.creds = creds
@@ -91,6 +94,7 @@ class Message(object):
         self.snippet = snippet
         self.plain = plain
         self.html = html
+        self._label_resolver = label_resolver
         self.label_ids = label_ids or []
         self.attachments = attachments or []
         self.headers = headers or {}
@@ -99,11 +103,32 @@ class Message(object):
 
     @property
     def service(self) -> 'googleapiclient.discovery.Resource':
-        if self.creds.access_token_expired:
-            self.creds.refresh(Http())
-
+        # An expired token is refreshed by the service's authorized Http
+        # object when a request is rejected with a 401.
         return self._service
 
+    @property
+    def label_ids(self) -> List[Label]:
+        if self._unresolved_label_ids is not None:
+            user_labels = self._label_resolver()
+            self._label_ids = [
+                user_labels.get(x, x) for x in self._unresolved_label_ids
+            ]
+            self._unresolved_label_ids = None
+
+        return self._label_ids
+
+    @label_ids.setter
+    def label_ids(self, label_ids: Union[List[Label], List[str]]) -> None:
+        # Resolving ids may require fetching the account's labels, so it is
+        # put off until the labels are actually used, and skipped when there
+        # are none.
+        if self._label_resolver is None or not label_ids:
+            self._label_ids = label_ids
+            self._unresolved_label_ids = None
+        else:
+            self._unresolved_label_ids = label_ids
+
     def __repr__(self) -> str:
         """Represents the object by its sender, recipient, and id."""
 
@@ -238,7 +263,7 @@ class Message(object):
         """
 
         try:
-            res = self._service.users().messages().trash(
+            res = self.service.users().messages().trash(
                 userId=self.user_id, id=self.id,
             ).execute()
 
@@ -263,7 +288,7 @@ class Message(object):
         """
 
         try:
-            res = self._service.users().messages().untrash(
+            res = self.service.users().messages().untrash(
                 userId=self.user_id, id=self.id,
             ).execute()
 
@@ -377,7 +402,7 @@ class Message(object):
             to_remove = [to_remove]
 
         try:
-            res = self._service.users().messages().modify(
+            res = self.service.users().messages().modify(
                 userId=self.user_id, id=self.id,
                 body=self._create_update_labels(to_add, to_remove)
             ).execute()
@@ -416,11 +441,8 @@ class Message(object):
         if to_remove is None:
             to_remove = []
 
+        # Labels may be given as Label objects or as label ID strings.
         return {
-            'addLabelIds': [
-                lbl.id if isinstance(lbl, Label) else lbl for lbl in to_add
-            ],
-            'removeLabelIds': [
-                lbl.id if isinstance(lbl, Label) else lbl for lbl in to_remove
-            ]
+            'addLabelIds': [getattr(lbl, 'id', lbl) for lbl in to_add],
+            'removeLabelIds': [getattr(lbl, 'id', lbl) for lbl in to_remove]
         }
@@ -0,0 +1,43 @@
+import base64
+from unittest import mock
+
+from simplegmail._attachment_cache import AttachmentCache
+from simplegmail.attachment import Attachment
+
+class TestAttachmentCache(object):
+
+    def test_roundtrip(self, tmp_path):
+        cache = AttachmentCache(str(tmp_path / 'attachments'))
+
+        cache.put('msg', '1', b'data')
+        assert cache.get('msg', '1') == b'data'
+
+    def test_miss(self, tmp_path):
+        cache = AttachmentCache(str(tmp_path / 'attachments'))
+        cache.put('msg', '1', b'data')
+
+        assert cache.get('msg', '2') is None
+        assert cache.get('other', '1') is None
+
+    def test_fetch_uses_cache(self, tmp_path):
+        cache = AttachmentCache(str(tmp_path / 'attachments'))
+        resource = mock.Mock()
+        resource.get.return_value.execute.return_value = {
+            'data': base64.urlsafe_b64encode(b'data').decode()
+        }
+
+        def attachment(att_id):
+            # Gmail hands out a new attachment id on every fetch.
+            return Attachment(None, 'me', 'msg', att_id, 'file.txt',
+                              'text/plain', attachments_resource=resource,
+                              part_id='1', cache=cache)
+
+        first = attachment('att1')
+        first.download()
+        assert first.data == b'data'
+        assert resource.get.call_count == 1
+
+        second = attachment('att2')
+        second.download()
+        assert second.data == b'data'
+        assert resource.get.call_count == 1
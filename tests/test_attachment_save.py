@@ -0,0 +1,91 @@
+import base64
+from unittest import mock
+
+import pytest
+
+from simplegmail import attachment
+from simplegmail.attachment import Attachment
+
+class TestAttachmentSave(object):
+
+    def _attachment(self, data):
+        return Attachment(None, 'me', 'msg', 'att', 'file.txt', 'text/plain',
+                          data)
+
+    def test_save_new_file(self, tmp_path):
+        filepath = tmp_path / 'file.txt'
+
+        self._attachment(b'new').save(str(filepath))
+        assert filepath.read_bytes() == b'new'
+
+    def test_save_no_overwrite(self, tmp_path):
+        filepath = tmp_path / 'file.txt'
+        filepath.write_bytes(b'old')
+
+        with pytest.raises(FileExistsError):
+            self._attachment(b'new').save(str(filepath))
+
+        assert filepath.read_bytes() == b'old'
+
+    def test_save_overwrite(self, tmp_path):
+        filepath = tmp_path / 'file.txt'
+        filepath.write_bytes(b'old contents')
+
+        self._attachment(b'new').save(str(filepath), overwrite=True)
+        assert filepath.read_bytes() == b'new'
+
+class TestAttachmentDownloadToFile(object):
+
+    def _attachment(self, resource):
+        return Attachment(None, 'me', 'msg', 'att', 'file.bin',
+                          'application/octet-stream',
+                          attachments_resource=resource)
+
+    def _resource(self, data):
+        resource = mock.Mock()
+        resource.get.return_value.execute.return_value = {
+            'data': base64.urlsafe_b64encode(data).decode()
+        }
+        return resource
+
+    def test_download_to_file(self, tmp_path, monkeypatch):
+        # Small chunks, so that the data is decoded in several pieces.
+        monkeypatch.setattr(attachment, '_DECODE_CHUNK_SIZE', 8)
+        data = bytes(range(256)) * 3
+        filepath = tmp_path / 'file.bin'
+
+        attm = self._attachment(self._resource(data))
+        attm.download_to_file(str(filepath))
+
+        assert filepath.read_bytes() == data
+        assert attm.data is None
+
+    def test_no_overwrite_skips_download(self, tmp_path):
+        filepath = tmp_path / 'file.bin'
+        filepath.write_bytes(b'old')
+        resource = self._resource(b'new')
+
+        with pytest.raises(FileExistsError):
+            self._attachment(resource).download_to_file(str(filepath))
+
+        assert filepath.read_bytes() == b'old'
+        resource.get.assert_not_called()
+
+    def test_failed_download_removes_file(self, tmp_path):
+        filepath = tmp_path / 'file.bin'
+        resource = mock.Mock()
+        resource.get.return_value.execute.side_effect = RuntimeError
+
+        with pytest.raises(RuntimeError):
+            self._attachment(resource).download_to_file(str(filepath))
+
+        assert not filepath.exists()
+
+    def test_save_keeps_data(self, tmp_path):
+        filepath = tmp_path / 'file.bin'
+
+        attm = self._attachment(self._resource(b'data'))
+        attm.save(str(filepath))
+
+        assert filepath.read_bytes() == b'data'
+        assert attm.data == b'data'
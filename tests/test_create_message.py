@@ -0,0 +1,33 @@
+import base64
+import email
+
+from simplegmail.gmail import Gmail
+
+class TestCreateMessage(object):
+
+    def _parse(self, raw_msg):
+        return email.message_from_bytes(
+            base64.urlsafe_b64decode(raw_msg['raw'])
+        )
+
+    def test_attachment_only_mime_version(self, tmp_path):
+        filepath = tmp_path / 'b.bin'
+        filepath.write_bytes(b'\x00\x01\x02')
+
+        gmail = Gmail.__new__(Gmail)
+        msg = self._parse(gmail._create_message(
+            'a@example.com', 'b@example.com', 'Subject',
+            attachments=[str(filepath)]
+        ))
+
+        assert msg.get_all('MIME-Version') == ['1.0']
+        assert msg.get_content_type() == 'multipart/mixed'
+        assert msg.get_payload()[0].get_payload(decode=True) == b'\x00\x01\x02'
+
+    def test_body_mime_version(self):
+        gmail = Gmail.__new__(Gmail)
+        msg = self._parse(gmail._create_message(
+            'a@example.com', 'b@example.com', 'Subject', msg_plain='Hi'
+        ))
+
+        assert msg.get_all('MIME-Version') == ['1.0']
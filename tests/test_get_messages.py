@@ -0,0 +1,104 @@
+import time
+from unittest import mock
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from simplegmail.gmail import Gmail
+
+def _gmail():
+    # A Gmail object without the authorization flow, for calls that never
+    # reach the network.
+    gmail = Gmail.__new__(Gmail)
+    gmail.creds = mock.Mock()
+    gmail._service = mock.Mock()
+    gmail._messages_resource = mock.Mock()
+    gmail._message_cache = None
+    gmail._attachment_cache = None
+    gmail._attachments_resource = mock.Mock()
+    gmail._labels_cache = {}
+    return gmail
+
+def _message_json(msg_id):
+    return {
+        'id': msg_id,
+        'threadId': msg_id,
+        'snippet': '',
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [],
+            'body': {'data': ''}
+        }
+    }
+
+class _Batch(object):
+    # Stands in for a BatchHttpRequest, failing as a whole with the given
+    # errors before it succeeds.
+
+    def __init__(self, callback, failures):
+        self.callback = callback
+        self.failures = failures
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        if self.failures:
+            raise self.failures.pop(0)
+
+        for msg_id, request_id in self.requests:
+            self.callback(request_id, _message_json(msg_id), None)
+
+class TestGetMessages(object):
+
+    def test_listing_stops_when_retrieval_fails(self):
+        gmail = _gmail()
+        lister_service = mock.Mock()
+        gmail._build_service = mock.Mock(return_value=lister_service)
+
+        # A mailbox that never runs out of pages.
+        list_calls = []
+        def list_page(messages_resource, user_id, query, labels_ids,
+                      include_spam_trash, page_token=None):
+            list_calls.append(page_token)
+            return {
+                'messages': [{'id': str(len(list_calls))}],
+                'nextPageToken': str(len(list_calls))
+            }
+
+        gmail._list_messages_page = list_page
+        gmail._iter_messages_from_refs = mock.Mock(
+            side_effect=RuntimeError('retrieval failed')
+        )
+
+        with pytest.raises(RuntimeError):
+            gmail.get_messages()
+
+        # The lister has exited (closing its connection) and lists no more.
+        lister_service.close.assert_called_once_with()
+        num_calls = len(list_calls)
+        time.sleep(0.05)
+        assert len(list_calls) == num_calls
+
+    def test_batch_retried_when_throttled(self, monkeypatch):
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+
+        gmail = _gmail()
+        failures = [HttpError(httplib2.Response({'status': 429}), b'')]
+        batches = []
+        def new_batch(callback):
+            batches.append(_Batch(callback, failures))
+            return batches[-1]
+
+        gmail._service.new_batch_http_request = new_batch
+        gmail._messages_resource.get = \
+            lambda userId, id, format: id
+
+        messages = gmail._get_raw_messages_batch(
+            'me', [{'id': 'a'}, {'id': 'b'}]
+        )
+
+        assert len(batches) == 2
+        assert [msg['id'] for msg in messages] == ['a', 'b']
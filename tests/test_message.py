@@ -0,0 +1,30 @@
+from unittest import mock
+
+from simplegmail.label import Label
+from simplegmail.message import Message
+
+class TestMessageLabels(object):
+
+    def _message(self, label_ids, label_resolver):
+        return Message(None, None, 'me', 'msg', 'thread', 'to', 'from',
+                       'subject', 'date', 'snippet', label_ids=label_ids,
+                       label_resolver=label_resolver)
+
+    def test_resolved_on_access(self):
+        inbox = Label('INBOX', 'INBOX')
+        resolver = mock.Mock(return_value={'INBOX': inbox})
+
+        msg = self._message(['INBOX', 'Label_1'], resolver)
+        resolver.assert_not_called()
+
+        assert msg.label_ids == [inbox, 'Label_1']
+        assert msg.label_ids == [inbox, 'Label_1']
+        resolver.assert_called_once_with()
+
+    def test_no_labels_not_resolved(self):
+        resolver = mock.Mock(return_value={})
+
+        msg = self._message([], resolver)
+
+        assert msg.label_ids == []
+        resolver.assert_not_called()
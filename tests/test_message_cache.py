@@ -0,0 +1,28 @@
+from simplegmail._message_cache import MessageCache
+
+class TestMessageCache(object):
+
+    def test_roundtrip(self, tmp_path):
+        cache = MessageCache(str(tmp_path / 'messages.sqlite'))
+        message = {'id': 'abc', 'labelIds': ['INBOX'], 'payload': {}}
+
+        assert cache.get_many(['abc']) == {}
+
+        cache.put_many([message])
+        assert cache.get_many(['abc', 'missing']) == {'abc': message}
+
+    def test_persists(self, tmp_path):
+        path = str(tmp_path / 'messages.sqlite')
+        MessageCache(path).put_many([{'id': 'abc'}])
+
+        assert MessageCache(path).get_many(['abc']) == {'abc': {'id': 'abc'}}
+
+    def test_close(self, tmp_path):
+        cache = MessageCache(str(tmp_path / 'messages.sqlite'))
+        cache.put_many([{'id': 'abc'}])
+
+        cache.close()
+        cache.close()
+
+        # The connection is reopened on the next use.
+        assert cache.get_many(['abc']) == {'abc': {'id': 'abc'}}